@@ -2,21 +2,56 @@
 """
 Combine intervals.icu data into a single LLM-friendly JSON file.
 Extracts key metrics from activity streams while keeping file size manageable.
+
+Requires numpy; orjson and ijson are used for faster JSON handling when installed,
+and msgpack is needed only for msgpack output.
 """
 
+import argparse
+import base64
+import gzip
 import json
 import os
-import random
-import string
+import secrets
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from datetime import datetime
+from operator import itemgetter
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterator
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib json module
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # fall back to loading the whole streams file
+    ijson = None
+
+try:
+    import msgpack
+except ImportError:  # only needed for --format msgpack
+    msgpack = None
 
 
 def generate_export_id() -> str:
     """Generate a random 5-digit alphanumeric identifier."""
-    chars = string.ascii_uppercase + string.digits
-    return ''.join(random.choices(chars, k=5))
+    return base64.b32encode(secrets.token_bytes(4))[:5].decode()
+
+# Array types for the streams used in metrics; HR and cadence are whole
+# numbers, so float32 stores them exactly while still allowing NaN gaps
+STREAM_DTYPES = {
+    "time": np.float64,
+    "distance": np.float64,
+    "velocity_smooth": np.float64,
+    "altitude": np.float64,
+    "fixed_altitude": np.float64,
+    "heartrate": np.float32,
+    "cadence": np.float32,
+}
 
 # Find the most recent download folder
 DATA_DIR = Path(__file__).parent.parent / "data"
@@ -35,18 +70,98 @@ def find_latest_download(folder_path: str | None = None) -> Path:
 
 def load_json(path: Path) -> Any:
     """Load a JSON file."""
+    if orjson is not None:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
     with open(path) as f:
         return json.load(f)
 
 
-def extract_splits_from_stream(activity_id: str, streams: list) -> list[dict]:
+def write_json(path: Path, data: dict, pretty: bool = False, compress: bool = False) -> None:
     """
-    Extract per-kilometer splits from activity streams.
-    Returns list of {km, pace_min_per_km, avg_hr, avg_cadence, elevation_gain}
+    Write a dict to a JSON file, compact by default or with 2-space indentation,
+    optionally gzip-compressed. With orjson, top-level values and the elements
+    of top-level lists are encoded one at a time, so the full document is never
+    built in memory.
+    """
+    if orjson is None:
+        with gzip.open(path, "wt", compresslevel=6) if compress else open(path, "w") as f:
+            # json.dump writes as it encodes
+            if pretty:
+                json.dump(data, f, indent=2)
+            else:
+                json.dump(data, f, separators=(",", ":"))
+        return
+
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+    newline = b"\n" if pretty else b""
+    indent = b"  " if pretty else b""
+    colon = b": " if pretty else b":"
+
+    def encode(value: Any, depth: int) -> bytes:
+        encoded = orjson.dumps(value, option=option)
+        return encoded.replace(b"\n", b"\n" + indent * depth) if pretty else encoded
+
+    with gzip.open(path, "wb", compresslevel=6) if compress else open(path, "wb", buffering=1 << 20) as f:
+        f.write(b"{")
+        for i, (key, value) in enumerate(data.items()):
+            f.write((b"," if i else b"") + newline + indent)
+            f.write(orjson.dumps(str(key)) + colon)
+            if isinstance(value, list) and value:
+                f.write(b"[")
+                for j, item in enumerate(value):
+                    f.write((b"," if j else b"") + newline + indent * 2)
+                    f.write(encode(item, 2))
+                f.write(newline + indent + b"]")
+            else:
+                f.write(encode(value, 1))
+        f.write(newline + b"}" if data else b"}")
+
+
+def write_msgpack(path: Path, data: dict) -> None:
+    """Write a dict to a msgpack file."""
+    with open(path, "wb") as f:
+        f.write(msgpack.packb(data, use_bin_type=True))
+
+
+def iter_activity_streams(path: Path) -> Iterator[tuple[str, list]]:
     """
-    # Build a lookup by stream type
-    stream_data = {s["type"]: s["data"] for s in streams}
+    Yield (activity_id, streams) pairs from an activity-streams.json file.
+    Parses incrementally with ijson when available so only one activity's
+    streams are held in memory at a time.
+    """
+    if ijson is None:
+        yield from load_json(path).items()
+        return
+    with open(path, "rb") as f:
+        yield from ijson.kvitems(f, "", use_float=True)
+
 
+def build_stream_data(streams: list) -> dict:
+    """
+    Build a lookup by stream type, decoding the streams used for metrics into
+    typed arrays (missing samples become NaN). Other streams are kept as-is.
+    """
+    stream_data = {}
+    for s in streams:
+        dtype = STREAM_DTYPES.get(s["type"])
+        stream_data[s["type"]] = s["data"] if dtype is None else np.asarray(s["data"], dtype=dtype)
+    return stream_data
+
+
+def prefix_sums(values: np.ndarray) -> np.ndarray:
+    """
+    Running totals with a leading zero, so the sum of values[i:j] is
+    sums[j] - sums[i]. Accumulates in float64 whatever the input dtype.
+    """
+    return np.concatenate(([0], np.cumsum(values, dtype=np.float64)))
+
+
+def extract_splits_from_stream(activity_id: str, stream_data: dict) -> list[dict]:
+    """
+    Extract per-kilometer splits from activity streams keyed by stream type.
+    Returns list of {km, pace_min_per_km, avg_hr, avg_cadence, elevation_gain}
+    """
     if "distance" not in stream_data or "time" not in stream_data:
         return []
 
@@ -54,58 +169,67 @@ def extract_splits_from_stream(activity_id: str, streams: list) -> list[dict]:
     time = stream_data["time"]
     heartrate = stream_data.get("heartrate", [])
     cadence = stream_data.get("cadence", [])
-    altitude = stream_data.get("altitude") or stream_data.get("fixed_altitude", [])
+    altitude = stream_data.get("altitude", [])
+    if not len(altitude):
+        altitude = stream_data.get("fixed_altitude", [])
+
+    if not len(distance):
+        return []
+
+    # Index where each km is reached; each sample closes at most one split
+    km_marks = np.arange(1, int(distance.max() // 1000) + 1) * 1000.0
+    ends = np.searchsorted(np.maximum.accumulate(distance), km_marks)
+    steps = np.arange(len(ends))
+    ends = np.maximum.accumulate(ends - steps) + steps
+    ends = ends[ends < len(distance)]
+    if not len(ends):
+        return []
+    starts = np.concatenate(([0], ends[:-1]))
+
+    # Split slices include both boundary samples, as the previous split's end
+    # is the next split's start
+    elapsed = time[ends] - np.concatenate(([0], time[ends[:-1]]))
+    paces = (elapsed / 60).tolist()  # minutes per km
+
+    avg_hrs = [None] * len(ends)
+    if len(heartrate):
+        hr_sums = prefix_sums(np.nan_to_num(heartrate))
+        avg_hrs = ((hr_sums[ends + 1] - hr_sums[starts]) / (ends + 1 - starts)).tolist()
+
+    avg_cads = [None] * len(ends)
+    if len(cadence):
+        cad = np.nan_to_num(cadence)
+        cad_sums = prefix_sums(cad)
+        cad_counts = prefix_sums(cad != 0)
+        cad_n = cad_counts[ends + 1] - cad_counts[starts]
+        cad_avgs = ((cad_sums[ends + 1] - cad_sums[starts]) / np.maximum(cad_n, 1)).tolist()
+        avg_cads = [avg if n else None for avg, n in zip(cad_avgs, cad_n.tolist())]
+
+    elev_gains = [0] * len(ends)
+    if len(altitude):
+        # Gaps in the altitude stream count as no gain
+        gains = np.nan_to_num(np.diff(altitude)).clip(min=0)
+        gain_sums = prefix_sums(gains)
+        elev_gains = (gain_sums[ends] - gain_sums[starts]).tolist()
 
     splits = []
-    km = 1
-    last_idx = 0
-    last_time = 0
-    last_alt = altitude[0] if altitude else 0
-
-    for i, dist in enumerate(distance):
-        if dist >= km * 1000:
-            # Calculate split metrics
-            elapsed = time[i] - last_time
-            pace = elapsed / 60  # minutes per km
-
-            # Average HR for this split
-            hr_slice = heartrate[last_idx:i+1] if heartrate else []
-            avg_hr = sum(hr_slice) / len(hr_slice) if hr_slice else None
-
-            # Average cadence for this split
-            cad_slice = cadence[last_idx:i+1] if cadence else []
-            avg_cad = sum(c for c in cad_slice if c) / len([c for c in cad_slice if c]) if cad_slice else None
-
-            # Elevation gain for this split
-            alt_slice = altitude[last_idx:i+1] if altitude else []
-            elev_gain = 0
-            if alt_slice:
-                for j in range(1, len(alt_slice)):
-                    if alt_slice[j] > alt_slice[j-1]:
-                        elev_gain += alt_slice[j] - alt_slice[j-1]
-
-            splits.append({
-                "km": km,
-                "pace_min_per_km": round(pace, 2),
-                "avg_hr": round(avg_hr) if avg_hr else None,
-                "avg_cadence": round(avg_cad) if avg_cad else None,
-                "elevation_gain_m": round(elev_gain, 1)
-            })
-
-            last_idx = i
-            last_time = time[i]
-            km += 1
+    for km, (pace, avg_hr, avg_cad, elev_gain) in enumerate(zip(paces, avg_hrs, avg_cads, elev_gains), start=1):
+        splits.append({
+            "km": km,
+            "pace_min_per_km": round(pace, 2),
+            "avg_hr": round(avg_hr) if avg_hr else None,
+            "avg_cadence": round(avg_cad) if avg_cad else None,
+            "elevation_gain_m": round(elev_gain, 1)
+        })
 
     return splits
 
 
-def extract_peak_efforts(streams: list, activity_type: str) -> dict:
+def extract_peak_efforts(stream_data: dict, activity_type: str) -> dict:
     """
     Extract peak efforts (best pace/power for various durations).
     Returns {peak_1min, peak_5min, peak_10min, peak_20min}
     """
-    stream_data = {s["type"]: s["data"] for s in streams}
-
     if "time" not in stream_data:
         return {}
 
@@ -113,68 +237,65 @@ def extract_peak_efforts(streams: list, activity_type: str) -> dict:
     velocity = stream_data.get("velocity_smooth", [])
     heartrate = stream_data.get("heartrate", [])
 
-    if not velocity:
+    if not len(velocity):
         return {}
 
+    # Prefix sums of moving (non-zero) velocity samples
+    vel = np.nan_to_num(velocity)
+    vel_sums = prefix_sums(vel)
+    vel_counts = prefix_sums(vel != 0)
+
     peaks = {}
     durations = [60, 300, 600, 1200]  # 1min, 5min, 10min, 20min
     duration_names = ["1min", "5min", "10min", "20min"]
 
     for dur, name in zip(durations, duration_names):
-        best_pace = None
+        # Each window runs from a start sample to the first sample dur seconds later
+        ends = np.searchsorted(time, time + dur)
+        starts = np.flatnonzero(ends < len(time))
+        if not len(starts):
+            continue
+        ends = ends[starts]
+
+        # Average velocity in each window
+        counts = vel_counts[ends + 1] - vel_counts[starts]
+        avg_vel = (vel_sums[ends + 1] - vel_sums[starts]) / np.maximum(counts, 1)
+        moving = avg_vel > 0
+        if not moving.any():
+            continue
+
+        paces = np.full(len(starts), np.inf)
+        paces[moving] = (1000 / avg_vel[moving]) / 60  # min/km
+        best_pace = paces.min()
+        # Earliest of the (near-)equal best windows, as prefix sums carry rounding noise
+        best = np.flatnonzero(paces <= best_pace * (1 + 1e-9))[0]
+
         best_hr = None
+        if len(heartrate):
+            hr_window = np.nan_to_num(heartrate[starts[best]:ends[best] + 1])
+            best_hr = float(hr_window.sum(dtype=np.float64)) / len(hr_window) if len(hr_window) else None
 
-        # Sliding window to find best average
-        for i in range(len(time)):
-            # Find end of window
-            end_idx = None
-            for j in range(i, len(time)):
-                if time[j] - time[i] >= dur:
-                    end_idx = j
-                    break
-
-            if end_idx is None:
-                break
-
-            # Calculate average velocity in window
-            window_vel = velocity[i:end_idx+1]
-            avg_vel = sum(v for v in window_vel if v) / len([v for v in window_vel if v]) if window_vel else 0
-
-            if avg_vel > 0:
-                pace = (1000 / avg_vel) / 60  # min/km
-                if best_pace is None or pace < best_pace:
-                    best_pace = pace
-                    if heartrate:
-                        hr_window = heartrate[i:end_idx+1]
-                        best_hr = sum(hr_window) / len(hr_window) if hr_window else None
-
-        if best_pace:
-            peaks[f"peak_{name}"] = {
-                "pace_min_per_km": round(best_pace, 2),
-                "avg_hr": round(best_hr) if best_hr else None
-            }
+        peaks[f"peak_{name}"] = {
+            "pace_min_per_km": round(float(best_pace), 2),
+            "avg_hr": round(best_hr) if best_hr else None
+        }
 
     return peaks
 
 
-def extract_hr_zones_detail(streams: list, hr_zones: list) -> dict:
+def extract_hr_zones_detail(stream_data: dict, hr_zones: list) -> dict:
     """
-    Calculate detailed HR zone distribution from streams.
+    Calculate detailed HR zone distribution from streams keyed by stream type.
     """
-    stream_data = {s["type"]: s["data"] for s in streams}
     heartrate = stream_data.get("heartrate", [])
 
-    if not heartrate or not hr_zones:
+    if not len(heartrate) or not hr_zones:
         return {}
 
-    zone_times = [0] * len(hr_zones)
-
-    for hr in heartrate:
-        if hr:
-            for i, zone_max in enumerate(hr_zones):
-                if hr < zone_max:
-                    zone_times[i] += 1
-                    break
+    # Bucket each recorded sample into the first zone whose max it is below
+    hr = np.nan_to_num(heartrate)
+    zone_idx = np.digitize(hr[hr != 0], hr_zones)
+    zone_times = np.bincount(zone_idx, minlength=len(hr_zones) + 1)[:len(hr_zones)].tolist()
 
     total = sum(zone_times)
     if total == 0:
@@ -186,26 +307,47 @@ def extract_hr_zones_detail(streams: list, hr_zones: list) -> dict:
     }
 
 
+def drop_none(record: dict) -> dict:
+    """Remove None values from a record in place and return it."""
+    for key in [k for k, v in record.items() if v is None]:
+        del record[key]
+    return record
+
+
+def uses_streams(activity: dict, streams: list | None) -> bool:
+    """
+    Check whether any stream-based metric applies: per-km splits are only
+    extracted for runs, and peak efforts need a velocity stream.
+    """
+    if not streams:
+        return False
+    return activity.get("type") == "Run" or any(s["type"] == "velocity_smooth" for s in streams)
+
+
 def process_activity(activity: dict, streams: list | None) -> dict:
     """
     Process a single activity, extracting key metrics and stream summaries.
     """
+    start_date_local = activity.get("start_date_local") or ""
+    distance = activity.get("distance") or 0
+    moving_time = activity.get("moving_time") or 0
+
     # Core fields to keep
     result = {
         "id": activity.get("id"),
-        "date": activity.get("start_date_local", "")[:10],
-        "time": activity.get("start_date_local", "")[11:16],
+        "date": start_date_local[:10],
+        "time": start_date_local[11:16],
         "type": activity.get("type"),
         "name": activity.get("name"),
         "description": activity.get("description"),
 
         # Distance and time
-        "distance_km": round(activity.get("distance", 0) / 1000, 2),
-        "moving_time_min": round(activity.get("moving_time", 0) / 60, 1),
+        "distance_km": round(distance / 1000, 2),
+        "moving_time_min": round(moving_time / 60, 1),
         "elapsed_time_min": round(activity.get("elapsed_time", 0) / 60, 1),
 
         # Pace/Speed
-        "avg_pace_min_per_km": round((activity.get("moving_time", 0) / 60) / (activity.get("distance", 1) / 1000), 2) if activity.get("distance") else None,
+        "avg_pace_min_per_km": round((moving_time / 60) / (distance / 1000), 2) if distance else None,
         "avg_speed_kmh": round(activity.get("average_speed", 0) * 3.6, 1) if activity.get("average_speed") else None,
         "max_speed_kmh": round(activity.get("max_speed", 0) * 3.6, 1) if activity.get("max_speed") else None,
         "gap_pace": activity.get("gap"),  # Grade adjusted pace
@@ -243,20 +385,51 @@ def process_activity(activity: dict, streams: list | None) -> dict:
     }
 
     # Extract stream-based metrics if available
-    if streams:
+    if uses_streams(activity, streams):
+        stream_data = build_stream_data(streams)
+
         # Per-km splits
         if activity.get("type") == "Run":
-            splits = extract_splits_from_stream(activity["id"], streams)
+            splits = extract_splits_from_stream(activity["id"], stream_data)
             if splits:
                 result["km_splits"] = splits
 
         # Peak efforts
-        peaks = extract_peak_efforts(streams, activity.get("type", ""))
+        peaks = extract_peak_efforts(stream_data, activity.get("type", ""))
         if peaks:
             result["peak_efforts"] = peaks
 
     # Remove None values to keep JSON clean
-    return {k: v for k, v in result.items() if v is not None}
+    return drop_none(result)
+
+
+def process_streamed_activities(activities_by_id: dict, streams_file: Path) -> dict:
+    """
+    Process activities in a worker pool as their streams are parsed.
+    Returns processed activities keyed by id.
+    """
+    workers = os.cpu_count() or 1
+    processed_by_id = {}
+    pending = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for activity_id, activity_streams in iter_activity_streams(streams_file):
+            activity = activities_by_id.get(activity_id)
+            if activity is None or not uses_streams(activity, activity_streams):
+                continue
+
+            # Bound the streams queued for workers so memory stays flat
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    processed_by_id[pending.pop(future)] = future.result()
+
+            pending[executor.submit(process_activity, activity, activity_streams)] = activity_id
+
+        for future, activity_id in pending.items():
+            processed_by_id[activity_id] = future.result()
+
+    return processed_by_id
 
 
 def process_wellness(wellness: list) -> list[dict]:
@@ -267,7 +440,7 @@ def process_wellness(wellness: list) -> list[dict]:
 
     for day in wellness:
         record = {
-            "date": day.get("id"),
+            "date": day.get("id") or "",
 
             # Fitness/Fatigue
             "ctl_fitness": round(day.get("ctl", 0), 1),
@@ -304,7 +477,7 @@ def process_wellness(wellness: list) -> list[dict]:
         }
 
         # Remove None values
-        processed.append({k: v for k, v in record.items() if v is not None})
+        processed.append(drop_none(record))
 
     return processed
 
@@ -330,7 +503,7 @@ def process_calendar_events(events: list) -> list[dict]:
             "paired_activity_id": event.get("paired_activity_id"),
         }
 
-        processed.append({k: v for k, v in record.items() if v is not None})
+        processed.append(drop_none(record))
 
     return processed
 
@@ -338,99 +511,175 @@ def process_calendar_events(events: list) -> list[dict]:
 def calculate_summary_stats(activities: list, wellness: list) -> dict:
     """
     Calculate overall summary statistics for the period.
+    Activities and wellness records are each scanned once.
     """
-    runs = [a for a in activities if a.get("type") == "Run"]
-    rides = [a for a in activities if a.get("type") in ["Ride", "VirtualRide"]]
-
-    def sum_field(items, field):
-        return sum(i.get(field, 0) or 0 for i in items)
-
-    def avg_field(items, field):
-        vals = [i.get(field) for i in items if i.get(field)]
-        return round(sum(vals) / len(vals), 1) if vals else None
-
-    # Date range
-    dates = sorted([a.get("date") for a in activities if a.get("date")])
-    wellness_dates = sorted([w.get("date") for w in wellness if w.get("date")])
+    def avg(total, count):
+        return round(total / count, 1) if count else None
+
+    # Totals across all activities, runs and rides, accumulated in one pass
+    distance = time = elevation = load = calories = 0
+    runs = run_distance = run_time = run_elevation = 0
+    run_pace = run_pace_n = run_hr = run_hr_n = 0
+    rides = ride_distance = ride_time = 0
+    ride_speed = ride_speed_n = ride_hr = ride_hr_n = 0
+    start = end = None
+
+    for a in activities:
+        a_distance = a.get("distance_km", 0) or 0
+        a_time = a.get("moving_time_min", 0) or 0
+        a_elevation = a.get("elevation_gain_m", 0) or 0
+        distance += a_distance
+        time += a_time
+        elevation += a_elevation
+        load += a.get("training_load", 0) or 0
+        calories += a.get("calories", 0) or 0
+
+        date = a.get("date")
+        if date:
+            if start is None or date < start:
+                start = date
+            if end is None or date > end:
+                end = date
+
+        activity_type = a.get("type")
+        if activity_type == "Run":
+            runs += 1
+            run_distance += a_distance
+            run_time += a_time
+            run_elevation += a_elevation
+            if pace := a.get("avg_pace_min_per_km"):
+                run_pace += pace
+                run_pace_n += 1
+            if hr := a.get("avg_hr"):
+                run_hr += hr
+                run_hr_n += 1
+        elif activity_type in ["Ride", "VirtualRide"]:
+            rides += 1
+            ride_distance += a_distance
+            ride_time += a_time
+            if speed := a.get("avg_speed_kmh"):
+                ride_speed += speed
+                ride_speed_n += 1
+            if hr := a.get("avg_hr"):
+                ride_hr += hr
+                ride_hr_n += 1
+
+    # Wellness averages
+    wellness_dates = set()
+    resting_hr = resting_hr_n = sleep = sleep_n = steps = steps_n = 0
+    for w in wellness:
+        if date := w.get("date"):
+            wellness_dates.add(date)
+        if value := w.get("resting_hr"):
+            resting_hr += value
+            resting_hr_n += 1
+        if value := w.get("sleep_hours"):
+            sleep += value
+            sleep_n += 1
+        if value := w.get("steps"):
+            steps += value
+            steps_n += 1
 
     return {
         "period": {
-            "start": dates[0] if dates else None,
-            "end": dates[-1] if dates else None,
-            "days": len(set(wellness_dates)),
+            "start": start,
+            "end": end,
+            "days": len(wellness_dates),
         },
         "totals": {
             "activities": len(activities),
-            "runs": len(runs),
-            "rides": len(rides),
-            "total_distance_km": round(sum_field(activities, "distance_km"), 1),
-            "total_time_hours": round(sum_field(activities, "moving_time_min") / 60, 1),
-            "total_elevation_m": round(sum_field(activities, "elevation_gain_m"), 0),
-            "total_training_load": round(sum_field(activities, "training_load"), 0),
-            "total_calories": round(sum_field(activities, "calories"), 0),
+            "runs": runs,
+            "rides": rides,
+            "total_distance_km": round(distance, 1),
+            "total_time_hours": round(time / 60, 1),
+            "total_elevation_m": round(elevation, 0),
+            "total_training_load": round(load, 0),
+            "total_calories": round(calories, 0),
         },
         "running": {
-            "count": len(runs),
-            "distance_km": round(sum_field(runs, "distance_km"), 1),
-            "time_hours": round(sum_field(runs, "moving_time_min") / 60, 1),
-            "avg_pace_min_per_km": avg_field(runs, "avg_pace_min_per_km"),
-            "avg_hr": avg_field(runs, "avg_hr"),
-            "elevation_gain_m": round(sum_field(runs, "elevation_gain_m"), 0),
+            "count": runs,
+            "distance_km": round(run_distance, 1),
+            "time_hours": round(run_time / 60, 1),
+            "avg_pace_min_per_km": avg(run_pace, run_pace_n),
+            "avg_hr": avg(run_hr, run_hr_n),
+            "elevation_gain_m": round(run_elevation, 0),
         },
         "cycling": {
-            "count": len(rides),
-            "distance_km": round(sum_field(rides, "distance_km"), 1),
-            "time_hours": round(sum_field(rides, "moving_time_min") / 60, 1),
-            "avg_speed_kmh": avg_field(rides, "avg_speed_kmh"),
-            "avg_hr": avg_field(rides, "avg_hr"),
+            "count": rides,
+            "distance_km": round(ride_distance, 1),
+            "time_hours": round(ride_time / 60, 1),
+            "avg_speed_kmh": avg(ride_speed, ride_speed_n),
+            "avg_hr": avg(ride_hr, ride_hr_n),
         },
         "fitness_trend": {
             "ctl_start": wellness[0].get("ctl_fitness") if wellness else None,
             "ctl_end": wellness[-1].get("ctl_fitness") if wellness else None,
             "ctl_change": round(wellness[-1].get("ctl_fitness", 0) - wellness[0].get("ctl_fitness", 0), 1) if len(wellness) >= 2 else None,
-            "avg_resting_hr": avg_field(wellness, "resting_hr"),
-            "avg_sleep_hours": avg_field(wellness, "sleep_hours"),
-            "avg_steps": round(avg_field(wellness, "steps") or 0, 0),
+            "avg_resting_hr": avg(resting_hr, resting_hr_n),
+            "avg_sleep_hours": avg(sleep, sleep_n),
+            "avg_steps": round(avg(steps, steps_n) or 0, 0),
         }
     }
 
 
 def main():
-    import sys
-
-    # Accept folder path as command line argument
-    folder_path = sys.argv[1] if len(sys.argv) > 1 else None
+    parser = argparse.ArgumentParser(description="Combine intervals.icu data into a single LLM-friendly JSON file.")
+    parser.add_argument("folder", nargs="?", help="download folder (default: most recent in data/)")
+    parser.add_argument("--pretty", action="store_true", help="indent the output JSON (larger file)")
+    parser.add_argument("--quiet", action="store_true", help="only print the output file path")
+    parser.add_argument("--format", choices=["json", "json.gz", "msgpack"], default="json", help="output encoding (default: json)")
+    args = parser.parse_args()
+    if args.format == "msgpack" and msgpack is None:
+        parser.error("--format msgpack requires the msgpack package")
+
+    def log(*values):
+        if not args.quiet:
+            print(*values)
 
     # Find and load data
-    folder = find_latest_download(folder_path)
-    print(f"Loading data from: {folder}")
-
-    activities = load_json(folder / "activities-detailed.json")
-    wellness = load_json(folder / "wellness.json")
-    calendar = load_json(folder / "calendar-events.json")
-    athlete = load_json(folder / "athlete.json")
-
-    # Load streams (optional, may be large)
+    folder = find_latest_download(args.folder)
+    log(f"Loading data from: {folder}")
+
+    # Overlap reading the smaller files; file reads release the GIL
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        activities = executor.submit(load_json, folder / "activities-detailed.json")
+        wellness = executor.submit(load_json, folder / "wellness.json")
+        calendar = executor.submit(load_json, folder / "calendar-events.json")
+        athlete = executor.submit(load_json, folder / "athlete.json")
+    activities = activities.result()
+    wellness = wellness.result()
+    calendar = calendar.result()
+    athlete = athlete.result()
+
+    # Process activities with streams (optional, may be large) as they are parsed
+    activities_by_id = {a["id"]: a for a in activities}
+    processed_by_id = {}
     streams_file = folder / "activity-streams.json"
-    streams = {}
     if streams_file.exists():
-        print("Loading activity streams (this may take a moment)...")
-        streams = load_json(streams_file)
+        log("Processing activities with streams (this may take a moment)...")
+        processed_by_id = process_streamed_activities(activities_by_id, streams_file)
 
-    # Process data
-    print("Processing activities...")
+    # Process remaining activities, keeping the original order
+    log("Processing activities...")
     processed_activities = []
+    splits_count = peaks_count = 0
     for activity in activities:
-        activity_streams = streams.get(activity["id"], [])
-        processed_activities.append(process_activity(activity, activity_streams))
-
-    print("Processing wellness data...")
+        processed = processed_by_id.get(activity["id"])
+        if processed is None:
+            processed = process_activity(activity, [])
+        processed_activities.append(processed)
+        if "km_splits" in processed:
+            splits_count += 1
+        if "peak_efforts" in processed:
+            peaks_count += 1
+
+    log("Processing wellness data...")
     processed_wellness = process_wellness(wellness)
 
-    print("Processing calendar events...")
+    log("Processing calendar events...")
     processed_calendar = process_calendar_events(calendar)
 
-    print("Calculating summary statistics...")
+    log("Calculating summary statistics...")
     summary = calculate_summary_stats(processed_activities, processed_wellness)
 
     # Build final output
@@ -443,34 +692,38 @@ def main():
             "id": athlete.get("id"),
         },
         "summary": summary,
-        "activities": sorted(processed_activities, key=lambda x: x.get("date", ""), reverse=True),
-        "wellness": sorted(processed_wellness, key=lambda x: x.get("date", ""), reverse=True),
+        "activities": sorted(processed_activities, key=itemgetter("date"), reverse=True),
+        "wellness": sorted(processed_wellness, key=itemgetter("date"), reverse=True),
         "planned_workouts": [e for e in processed_calendar if e.get("category") == "WORKOUT"],
     }
 
     # Save output with export_id in filename
-    output_file = folder / f"llm-ready-{export_id}.json"
-    with open(output_file, "w") as f:
-        json.dump(output, f, indent=2)
+    output_file = folder / f"llm-ready-{export_id}.{args.format}"
+    if args.format == "msgpack":
+        write_msgpack(output_file, output)
+    else:
+        write_json(output_file, output, pretty=args.pretty, compress=args.format == "json.gz")
 
     # Print summary
-    print(f"\n{'='*60}")
-    print(f"OUTPUT SUMMARY - Export ID: {export_id}")
-    print(f"{'='*60}")
-    print(f"File: {output_file}")
-    print(f"Size: {output_file.stat().st_size / 1024:.1f} KB")
-    print(f"Export ID: {export_id}")
-    print(f"\nContains:")
-    print(f"  - {len(processed_activities)} activities with detailed metrics")
-    print(f"  - {len(processed_wellness)} wellness records")
-    print(f"  - {len(output['planned_workouts'])} planned workouts")
-    print(f"  - Per-km splits for {sum(1 for a in processed_activities if 'km_splits' in a)} runs")
-    print(f"  - Peak efforts for {sum(1 for a in processed_activities if 'peak_efforts' in a)} activities")
-    print(f"\nSummary stats:")
-    print(f"  - Period: {summary['period']['start']} to {summary['period']['end']}")
-    print(f"  - Total distance: {summary['totals']['total_distance_km']} km")
-    print(f"  - CTL change: {summary['fitness_trend']['ctl_start']} → {summary['fitness_trend']['ctl_end']}")
-    print(f"{'='*60}")
+    log(f"\n{'='*60}")
+    log(f"OUTPUT SUMMARY - Export ID: {export_id}")
+    log(f"{'='*60}")
+    log(f"File: {output_file}")
+    log(f"Size: {output_file.stat().st_size / 1024:.1f} KB")
+    log(f"Export ID: {export_id}")
+    log(f"\nContains:")
+    log(f"  - {len(processed_activities)} activities with detailed metrics")
+    log(f"  - {len(processed_wellness)} wellness records")
+    log(f"  - {len(output['planned_workouts'])} planned workouts")
+    log(f"  - Per-km splits for {splits_count} runs")
+    log(f"  - Peak efforts for {peaks_count} activities")
+    log(f"\nSummary stats:")
+    log(f"  - Period: {summary['period']['start']} to {summary['period']['end']}")
+    log(f"  - Total distance: {summary['totals']['total_distance_km']} km")
+    log(f"  - CTL change: {summary['fitness_trend']['ctl_start']} → {summary['fitness_trend']['ctl_end']}")
+    log(f"{'='*60}")
+    if args.quiet:
+        print(output_file)
 
 
 if __name__ == "__main__":